@@ -1,11 +1,37 @@
 import streamlit as st
-import json
+import orjson # Faster JSON encode/decode for Gemini payloads
 import asyncio
 import os
 import io
-import difflib # For highlighting changes
-from pdfminer.high_level import extract_text # For PDF text extraction
+import re
+import threading
+import atexit
+import hashlib
+import logging
+import random
+import sqlite3
+import time
+from functools import lru_cache
+from html import escape
+from typing import Optional
+try:
+    from cdifflib import CSequenceMatcher as SequenceMatcher # C-accelerated drop-in for aligning changed lines
+except ImportError:
+    from difflib import SequenceMatcher # For aligning changed lines
+try:
+    from diff_match_patch import diff_match_patch # For highlighting changes within lines
+except ImportError:
+    diff_match_patch = None # Changed lines are then diffed word by word with difflib
+import pypdfium2 as pdfium # For fast PDF text extraction
+from pdfminer.high_level import extract_text # Fallback PDF text extraction
+from pdfminer.layout import LAParams
+import diskcache # For persisting Gemini responses across restarts
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+logger = logging.getLogger(__name__)
 
 # --- Streamlit UI config (MUST BE THE FIRST Streamlit COMMAND) ---
 st.set_page_config(page_title="AI Resume Tailor", layout="centered")
@@ -22,12 +48,62 @@ else:
     st.success("Gemini API Key loaded successfully.") # This confirms the key is being picked up
 
 GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
+GEMINI_STREAM_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:streamGenerateContent"
+GEMINI_CACHE_DIR = os.getenv("GEMINI_CACHE_DIR", "./.gemini_cache") # Where Gemini responses are persisted; "" disables it
+GEMINI_CACHE_TTL_SECONDS = 86400 # How long on-disk Gemini responses stay valid
+GEMINI_MAX_CONCURRENT_REQUESTS = 5 # Per server process, shared by all sessions
+GEMINI_MAX_ATTEMPTS = 5 # Total tries for a rate-limited or transiently failing request
+GEMINI_RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Set REZUME_FUSED_PIPELINE=1 to tailor, score and review in a single Gemini call instead of three
+FUSED_PIPELINE = os.getenv("REZUME_FUSED_PIPELINE") == "1"
+GEMINI_TIMEOUT = (5, 60) # (connect, read) seconds; fail fast on unreachable hosts, allow long generations
 
-# --- Function to call Gemini API ---
-async def call_gemini_api(prompt_text: str, temperature: float = 0.7, max_output_tokens: int = 2048, response_schema: dict = None):
+# --- Limits on uploaded resumes ---
+MAX_RESUME_BYTES = 2_000_000 # Reject larger uploads before parsing them
+MAX_RESUME_PAGES = 5 # Only the first pages of a PDF are extracted
+MAX_RESUME_PROMPT_CHARS = 12_000 # Resume text past this is left out of prompts (typically garbled PDF extraction)
+# Output budgets sized for a full rewrite of a MAX_RESUME_PROMPT_CHARS resume (~3k tokens) plus headroom for the
+# "Detailed" style; the fused reply also carries the keywords and the review
+TAILOR_MAX_OUTPUT_TOKENS = 4096
+FUSED_MAX_OUTPUT_TOKENS = 6144
+
+# --- Shared HTTP session for the Gemini API ---
+@st.cache_resource
+def _http_session() -> requests.Session:
     """
-    Makes an asynchronous call to the Gemini API to generate content.
-    Oftenly accepts a response_schema for structured output.
+    Returns a process-wide requests session so Gemini calls reuse pooled keep-alive connections
+    instead of paying a fresh TCP + TLS handshake on every request.
+    """
+    session = requests.Session()
+    session.headers.update({'Content-Type': 'application/json'})
+    # Transport-level retries only cover failed connects (nothing was sent yet); HTTP status retries live in _post_gemini
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=10, max_retries=Retry(total=3, connect=3, read=0, status=0, backoff_factor=0.5))
+    session.mount('https://', adapter)
+    atexit.register(session.close) # Release pooled sockets when the server shuts down
+    return session
+
+# --- On-disk cache of Gemini responses ---
+@st.cache_resource
+def _response_cache() -> Optional[diskcache.Cache]:
+    """
+    Returns the disk cache holding raw Gemini responses, shared by all sessions and kept across app restarts.
+    Returns None when GEMINI_CACHE_DIR is set to "" or can't be created or opened (e.g. a read-only deployment);
+    responses are then only cached in memory.
+    """
+    if not GEMINI_CACHE_DIR:
+        return None # Disabled, so resumes and tailored output are never written to disk
+    try:
+        cache = diskcache.Cache(GEMINI_CACHE_DIR)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("Disk cache for Gemini responses disabled, %s is not usable: %s", GEMINI_CACHE_DIR, e)
+        return None
+    atexit.register(cache.close)
+    return cache
+
+# --- Request body and cache key for the Gemini API ---
+def _gemini_payload(prompt_text: str, temperature: float, max_output_tokens: int, schema_json_str: str = "") -> dict:
+    """
+    Builds the generateContent request body, optionally asking for JSON output that follows a schema.
     """
     payload = {
         "contents": [
@@ -44,64 +120,287 @@ async def call_gemini_api(prompt_text: str, temperature: float = 0.7, max_output
         }
     }
 
-    if response_schema:
+    if schema_json_str:
         payload["generationConfig"]["responseMimeType"] = "application/json"
-        payload["generationConfig"]["responseSchema"] = response_schema
+        payload["generationConfig"]["responseSchema"] = orjson.loads(schema_json_str)
+    return payload
 
-    headers = {
-        'Content-Type': 'application/json'
-    }
+_PROMPT_PLACEHOLDER = "\x00prompt\x00"
+
+@lru_cache(maxsize=16) # One entry per generation config; a plain memo, no Streamlit hashing per call
+def _gemini_body_template(temperature: float, max_output_tokens: int, schema_json_str: str = "") -> tuple:
+    """
+    Pre-serializes the request body for one generation config, split around the prompt.
+    Each call then only JSON-encodes its prompt string instead of rebuilding and re-serializing the whole payload.
+    """
+    body = orjson.dumps(_gemini_payload(_PROMPT_PLACEHOLDER, temperature, max_output_tokens, schema_json_str), option=orjson.OPT_SORT_KEYS)
+    head, tail = body.split(orjson.dumps(_PROMPT_PLACEHOLDER))
+    return head, tail
+
+def _gemini_request_body(prompt_text: str, temperature: float, max_output_tokens: int, schema_json_str: str = "") -> bytes:
+    """
+    Returns the serialized generateContent request body (same bytes as orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)).
+    """
+    head, tail = _gemini_body_template(temperature, max_output_tokens, schema_json_str)
+    return head + orjson.dumps(prompt_text) + tail
+
+def _gemini_cache_key(body: bytes) -> str:
+    """
+    Identical prompt + generation config always maps to the same key, so repeat runs skip the network.
+    """
+    return hashlib.sha256(body).hexdigest()
+
+# --- Rate-limited, retrying POST to the Gemini API ---
+@st.cache_resource
+def _gemini_slots() -> threading.BoundedSemaphore:
+    """
+    Returns the process-wide semaphore capping how many Gemini requests are in flight across all sessions.
+    """
+    return threading.BoundedSemaphore(GEMINI_MAX_CONCURRENT_REQUESTS)
+
+def _post_gemini(url: str, body: bytes, stream: bool = False) -> requests.Response:
+    """
+    POSTs a request body to the Gemini API, retrying rate limits (429) and transient server errors
+    with exponential backoff. Honors the Retry-After header when Gemini sends one.
+    Raises HTTPError once retries are exhausted or for any non-retryable error status.
+    """
+    for attempt in range(GEMINI_MAX_ATTEMPTS):
+        response = _http_session().post(url, data=body, stream=stream, timeout=GEMINI_TIMEOUT)
+        if response.status_code not in GEMINI_RETRY_STATUSES or attempt == GEMINI_MAX_ATTEMPTS - 1:
+            response.raise_for_status() # Raises HTTPError for bad responses (4xx or 5xx)
+            return response
+        retry_after = response.headers.get("Retry-After", "")
+        delay = float(retry_after) if retry_after.isdigit() else 2 ** attempt + random.random()
+        response.close()
+        time.sleep(min(30, delay))
+
+# --- Cached request to the Gemini API ---
+class IncompleteGeminiResponse(Exception):
+    """
+    Raised for a successful HTTP reply whose generation didn't finish (token limit, safety block, no text).
+    Raising instead of returning keeps the reply out of both caches, so a retry asks Gemini again.
+    """
+    def __init__(self, finish_reason: str):
+        super().__init__(f"Gemini response did not complete (finish reason: {finish_reason})")
+        self.finish_reason = finish_reason
+
+def _finish_reason(result: dict) -> str:
+    """
+    Returns why Gemini stopped generating: the first candidate's finishReason, or the prompt's block reason
+    when no candidate came back at all. "STOP" with text present means the reply is complete.
+    """
+    candidates = result.get("candidates") or []
+    if not candidates:
+        return result.get("promptFeedback", {}).get("blockReason", "NO_CANDIDATES")
+    parts = candidates[0].get("content", {}).get("parts") or [{}]
+    if not parts[0].get("text"):
+        return "NO_TEXT"
+    return candidates[0].get("finishReason", "UNKNOWN")
+
+@st.cache_data(ttl=3600, max_entries=128, show_spinner=False)
+def _call_gemini_sync(prompt_text: str, temperature: float, max_output_tokens: int, schema_json_str: str) -> dict:
+    """
+    Sends a single generateContent request and returns the raw API response.
+    Results are cached on the arguments, so Streamlit reruns with an unchanged prompt skip the network.
+    HTTP errors and incomplete generations are raised rather than returned, which keeps them out of the cache.
+    """
+    body = _gemini_request_body(prompt_text, temperature, max_output_tokens, schema_json_str)
+    cache_key = _gemini_cache_key(body)
+    cache = _response_cache()
+    cached_result = cache.get(cache_key) if cache is not None else None
+    if cached_result is not None and _finish_reason(cached_result) == "STOP":
+        return cached_result
+
+    with _gemini_slots():
+        result = orjson.loads(_post_gemini(f"{GEMINI_API_URL}?key={GEMINI_API_KEY}", body).content)
+    finish_reason = _finish_reason(result)
+    if finish_reason != "STOP":
+        logger.debug("Incomplete Gemini API response: %s", result)
+        raise IncompleteGeminiResponse(finish_reason)
+    if cache is not None:
+        cache.set(cache_key, result, expire=GEMINI_CACHE_TTL_SECONDS)
+    return result
+
+# --- Streaming request to the Gemini API ---
+def stream_gemini_api(prompt_text: str, temperature: float = 0.7, max_output_tokens: int = 2048):
+    """
+    Yields generated text as Gemini produces it (server-sent events), for use with st.write_stream.
+    Completed responses are stored in the same disk cache as regular calls and replayed in one chunk.
+    Raises requests exceptions on failure (see report_gemini_request_error), and IncompleteGeminiResponse
+    once the stream ends if Gemini stopped before finishing (see report_incomplete_gemini_response).
+    """
+    body = _gemini_request_body(prompt_text, temperature, max_output_tokens)
+    cache_key = _gemini_cache_key(body)
+    cache = _response_cache()
+    cached_result = cache.get(cache_key) if cache is not None else None
+    if cached_result is not None and _finish_reason(cached_result) == "STOP":
+        yield cached_result["candidates"][0]["content"]["parts"][0]["text"]
+        return
+
+    streamed_parts = []
+    finish_reason = None
+    with _gemini_slots(), _post_gemini(f"{GEMINI_STREAM_URL}?alt=sse&key={GEMINI_API_KEY}", body, stream=True) as response:
+        for line in response.iter_lines():
+            if not line.startswith(b"data:"):
+                continue # Skip keep-alive blank lines and non-data SSE fields
+            chunk = orjson.loads(line[len(b"data:"):])
+            candidates = chunk.get("candidates") or [{}]
+            finish_reason = candidates[0].get("finishReason", finish_reason)
+            for part in candidates[0].get("content", {}).get("parts", []):
+                if part.get("text"):
+                    streamed_parts.append(part["text"])
+                    yield part["text"]
+
+    # A generation cut off by token limits or safety filters is an error, as in _call_gemini_sync, and is never cached
+    if not streamed_parts:
+        raise IncompleteGeminiResponse("NO_TEXT")
+    if finish_reason != "STOP":
+        raise IncompleteGeminiResponse(finish_reason or "UNKNOWN")
+    if cache is not None:
+        # Cache in the generateContent response shape so both call paths can share entries
+        result = {"candidates": [{"content": {"parts": [{"text": "".join(streamed_parts)}]}, "finishReason": finish_reason}]}
+        cache.set(cache_key, result, expire=GEMINI_CACHE_TTL_SECONDS)
+
+# --- Function to report a failed Gemini request ---
+def report_gemini_request_error(e: requests.exceptions.RequestException):
+    """
+    Shows a user-facing error describing why a request to the Gemini API failed.
+    """
+    if isinstance(e, requests.exceptions.HTTPError):
+        st.error(f"HTTP Error calling Gemini API: {e.response.status_code} - {e.response.text}")
+    elif isinstance(e, requests.exceptions.ConnectionError):
+        st.error(f"Connection Error calling Gemini API. Check internet connection or API endpoint reachability: {e}")
+    elif isinstance(e, requests.exceptions.Timeout):
+        st.error(f"Timeout Error calling Gemini API. The request took too long: {e}")
+    else:
+        st.error(f"Generic Request Error calling Gemini API: {e}")
+
+def report_incomplete_gemini_response(e: IncompleteGeminiResponse):
+    """
+    Shows a user-facing error for a Gemini reply that stopped before finishing (see IncompleteGeminiResponse).
+    """
+    if e.finish_reason == "MAX_TOKENS":
+        st.error("Gemini's response was cut off before it finished. Please try again.")
+    else:
+        st.error(f"Gemini did not return a complete response (reason: {e.finish_reason}). Please try again or adjust your inputs.")
+
+# --- Run blocking work off the event loop ---
+async def _run_in_thread(func, *args):
+    """
+    Runs a blocking function in a worker thread so awaiting it doesn't stall other tasks.
+    The worker shares this script run's Streamlit context, so caching keeps working inside it.
+    """
+    ctx = get_script_run_ctx()
+
+    def target():
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return func(*args)
+
+    return await asyncio.to_thread(target)
 
-    # st.write(f"Attempting to call Gemini API at: {GEMINI_API_URL}") # Debugging
+# --- Function to call Gemini API ---
+async def call_gemini_api(prompt_text: str, temperature: float = 0.7, max_output_tokens: int = 2048, schema_json_str: str = ""):
+    """
+    Makes an asynchronous call to the Gemini API to generate content.
+    Oftenly accepts a pre-serialized response schema (schema_json_str) for structured output.
+    """
+    logger.debug("Calling Gemini API at %s", GEMINI_API_URL)
     # Note: Do NOT print GEMINI_API_KEY directly in production logs for security reasons.
 
     try:
-        response = requests.post(f"{GEMINI_API_URL}?key={GEMINI_API_KEY}", json=payload, headers=headers)
-        response.raise_for_status() # Raises HTTPError for bad responses (4xx or 5xx)
-        result = response.json()
+        result = await _run_in_thread(_call_gemini_sync, prompt_text, temperature, max_output_tokens, schema_json_str)
 
-        # st.write(f"Gemini API raw response status: {response.status_code}") # Debugging
-        # st.write(f"Gemini API raw response body: {result}") # For detailed debugging, but can be verbose
+        logger.debug("Gemini API raw response body: %s", result)
 
         if result.get("candidates") and len(result["candidates"]) > 0 and \
            result["candidates"][0].get("content") and \
            result["candidates"][0]["content"].get("parts") and \
            len(result["candidates"][0]["content"]["parts"]) > 0:
             generated_content = result["candidates"][0]["content"]["parts"][0]["text"]
-            if response_schema:
+            if schema_json_str:
                 try:
-                    return json.loads(generated_content)
-                except json.JSONDecodeError:
+                    return orjson.loads(generated_content)
+                except orjson.JSONDecodeError:
                     st.error("Failed to parse JSON response from Gemini API. Check API response format.")
-                    st.write(f"Raw non-JSON response received: {generated_content}") # For debugging
+                    logger.debug("Raw non-JSON response received: %s", generated_content)
                     return None
             else:
                 return generated_content
         else:
             st.error("Gemini API response structure is unexpected or content is missing. This often indicates an API error or rate limit.")
-            st.write(f"Unexpected Gemini API response: {result}") # Debugging
+            logger.debug("Unexpected Gemini API response: %s", result)
             return None
-    except requests.exceptions.HTTPError as e:
-        st.error(f"HTTP Error calling Gemini API: {e.response.status_code} - {e.response.text}")
-        return None
-    except requests.exceptions.ConnectionError as e:
-        st.error(f"Connection Error calling Gemini API. Check internet connection or API endpoint reachability: {e}")
-        return None
-    except requests.exceptions.Timeout as e:
-        st.error(f"Timeout Error calling Gemini API. The request took too long: {e}")
-        return None
     except requests.exceptions.RequestException as e:
-        st.error(f"Generic Request Error calling Gemini API: {e}")
+        report_gemini_request_error(e)
+        return None
+    except IncompleteGeminiResponse as e:
+        report_incomplete_gemini_response(e)
         return None
     except Exception as e:
         st.error(f"An unexpected error occurred during API call: {e}")
         return None
 
+# --- Function to read the uploaded resume ---
+def read_resume_text(data: bytes, file_type: str) -> str:
+    """
+    Returns the text of an uploaded resume, decoding TXT files and extracting PDF ones.
+    """
+    if file_type == "application/pdf":
+        return extract_pdf_text(data)
+    return data.decode("utf-8", errors="replace") # A stray non-UTF-8 byte shouldn't reject the whole resume
+
+# --- Function to compact resume and job text before prompting ---
+_HORIZONTAL_WHITESPACE = re.compile(r"[^\S\n]+") # Runs of spaces/tabs, but not line breaks
+PROMPT_DEDUPE_MIN_CHARS = 40 # Only bullet-length lines are deduplicated; short headings may legitimately repeat
+
+def compact_for_prompt(text: str) -> str:
+    """
+    Shrinks text before it is embedded in a prompt: collapses whitespace, drops symbol-only lines,
+    removes repeated long lines and keeps at most one blank line between blocks.
+    Only prompts use this; the diff view still compares the original text.
+    """
+    kept_lines = []
+    seen_lines = set()
+    for line in _HORIZONTAL_WHITESPACE.sub(" ", text).split("\n"):
+        line = line.strip()
+        if not line:
+            if kept_lines and kept_lines[-1]:
+                kept_lines.append("")
+            continue
+        if not any(char.isalnum() for char in line):
+            continue # Rules, dot leaders and bullet-only lines carry no content
+        if len(line) >= PROMPT_DEDUPE_MIN_CHARS:
+            if line in seen_lines:
+                continue
+            seen_lines.add(line)
+        kept_lines.append(line)
+    return "\n".join(kept_lines).strip()
+
+def fit_resume_for_prompt(resume_content: str) -> str:
+    """
+    Compacts the resume for a prompt and, past MAX_RESUME_PROMPT_CHARS, cuts it at the last line break
+    before the limit (never mid-line), telling the user that the rest was left out.
+    """
+    resume_content = compact_for_prompt(resume_content)
+    if len(resume_content) <= MAX_RESUME_PROMPT_CHARS:
+        return resume_content
+    cut = resume_content.rfind("\n", 0, MAX_RESUME_PROMPT_CHARS + 1)
+    if cut <= 0:
+        cut = resume_content.rfind(" ", 0, MAX_RESUME_PROMPT_CHARS + 1) # One enormous line; at least keep whole words
+    if cut <= 0:
+        cut = MAX_RESUME_PROMPT_CHARS
+    st.info(
+        f"Your resume is longer than {MAX_RESUME_PROMPT_CHARS:,} characters, so only the part before that point was tailored. "
+        "The rest will show up as removed in the highlighted changes."
+    )
+    return resume_content[:cut].rstrip()
+
 # --- Function to extract keywords from Job Description ---
 async def extract_keywords(job_description: str) -> str:
     """
     Uses Gemini API to extract key skills and requirements from a job description.
     """
+    job_description = compact_for_prompt(job_description)
     prompt = f"""
     Extract the most important 10-15 keywords, key skills, and essential requirements from the following job description.
     List them as a comma-separated string. Do not include any other text or conversational phrases.
@@ -115,19 +414,103 @@ async def extract_keywords(job_description: str) -> str:
     keywords = await call_gemini_api(prompt, temperature=0.2, max_output_tokens=100)
     return keywords if keywords else ""
 
+# --- Function to overlap resume parsing with keyword extraction ---
+async def read_resume_and_extract_keywords(data: bytes, file_type: str, job_description: str):
+    """
+    Parses the resume in a worker thread while the keyword request to Gemini is in flight.
+    The two steps are independent, so the PDF parse is hidden behind the network round-trip.
+    """
+    resume_content, keywords = await asyncio.gather(
+        _run_in_thread(read_resume_text, data, file_type),
+        extract_keywords(job_description)
+    )
+    return resume_content, keywords
+
+# --- Function to build the tailoring prompt ---
+def tailoring_guidance_for(tailoring_style: str) -> str:
+    """
+    Returns the prompt sentence describing the chosen tailoring style.
+    """
+    if tailoring_style == "Concise":
+        return "Make the tailored resume concise and to the point, focusing only on the most relevant information."
+    elif tailoring_style == "Detailed":
+        return "Provide a detailed and comprehensive tailored resume, elaborating on experiences where relevant."
+    else: # Standard
+        return "Provide a balanced and standard tailored resume."
+
+def build_tailoring_prompt(resume_content: str, job_title: str, job_description: str, extracted_keywords: str, tailoring_style: str) -> str:
+    """
+    Builds the prompt asking Gemini to rewrite the resume for the job, in the chosen tailoring style.
+    """
+    resume_content = fit_resume_for_prompt(resume_content)
+    job_description = compact_for_prompt(job_description)
+    if extracted_keywords:
+        keywords_instruction = f"Ensure the tailored resume highlights these specific keywords and phrases: {extracted_keywords}. "
+    else:
+        keywords_instruction = ""
+
+    tailoring_guidance = tailoring_guidance_for(tailoring_style)
+
+    return f"""
+    You are an expert resume writer and career coach. Your task is to tailor a given resume to a specific job description and job title.
+    {tailoring_guidance}
+    Focus on highlighting relevant skills, experiences, and achievements that directly match the requirements and keywords in the job description.
+    {keywords_instruction}
+    Ensure the tone is professional and impactful.
+    The output should ONLY be the tailored resume text. Do NOT include any conversational text, introductions, or conclusions.
+
+    ---
+    **Original Resume:**
+    {resume_content}
+
+    ---
+    **Job Title:**
+    {job_title}
+
+    ---
+    **Job Description:**
+    {job_description}
+
+    ---
+    **Tailored Resume:**
+    """
+
+# --- Function to stream the tailored resume into the page ---
+def stream_tailored_resume(prompt: str, stream_placeholder):
+    """
+    Streams the tailored resume into the caller's placeholder and returns the full text, or None on failure.
+    The streamed text stays visible while the review runs; the caller clears the placeholder once the
+    results section is about to render the final text.
+    """
+    try:
+        with st.spinner("Tailoring your resume... This might take a moment. ✨"):
+            with stream_placeholder.container():
+                return st.write_stream(stream_gemini_api(prompt, max_output_tokens=TAILOR_MAX_OUTPUT_TOKENS))
+    except requests.exceptions.RequestException as e:
+        report_gemini_request_error(e)
+        return None
+    except IncompleteGeminiResponse as e:
+        # The partial resume must not be reviewed, diffed or stored as if it were complete
+        report_incomplete_gemini_response(e)
+        return None
+
 # --- Function to get ATS score and human review ---
+_REVIEW_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "ats_score": {"type": "INTEGER", "description": "ATS compatibility score out of 100"},
+        "review": {"type": "STRING", "description": "Humanized review of the resume"}
+    },
+    "required": ["ats_score", "review"]
+}
+# Serialized once; the cached request is keyed on this plain, stable string
+_REVIEW_SCHEMA_JSON = orjson.dumps(_REVIEW_SCHEMA, option=orjson.OPT_SORT_KEYS).decode()
+
 async def get_resume_review_and_score(tailored_resume: str, job_title: str, job_description: str):
     """
     Uses Gemini API to provide an ATS score and a humanized review for the tailored resume.
     """
-    review_schema = {
-        "type": "OBJECT",
-        "properties": {
-            "ats_score": {"type": "INTEGER", "description": "ATS compatibility score out of 100"},
-            "review": {"type": "STRING", "description": "Humanized review of the resume"}
-        },
-        "required": ["ats_score", "review"]
-    }
+    job_description = compact_for_prompt(job_description)
 
     prompt = f"""
     You are a sophisticated AI system designed to evaluate resumes based on ATS (Applicant Tracking System) scoring criteria. 
@@ -161,33 +544,338 @@ async def get_resume_review_and_score(tailored_resume: str, job_title: str, job_
     """
     with st.spinner("Analyzing tailored resume for ATS score and human review..."):
         # Increased max_output_tokens and slightly reduced temperature for better JSON adherence
-        review_data = await call_gemini_api(prompt, temperature=0.3, max_output_tokens=1500, response_schema=review_schema)
+        review_data = await call_gemini_api(prompt, temperature=0.3, max_output_tokens=1500, schema_json_str=_REVIEW_SCHEMA_JSON)
         return review_data
 
+# --- Function to format the review for download ---
+def format_review_text(review_data: dict) -> str:
+    """
+    Returns the plain-text version of the ATS score and review offered as a TXT download.
+    """
+    return f"--- Resume Review and ATS Score ---\n\n" \
+           f"ATS Compatibility Score: {review_data['ats_score']}/100\n\n" \
+           f"Humanized Review:\n{review_data['review']}\n\n" \
+           f"--- End of Review ---"
+
+# --- Full tailoring pipeline ---
+async def run_tailoring_pipeline(resume_data: bytes, file_type: str, job_title: str, job_description: str, tailoring_style: str, stream_placeholder):
+    """
+    Runs every step of a tailoring request on one event loop, instead of one asyncio.run per step.
+    The tailored resume is streamed into stream_placeholder, which the caller clears when the results render.
+    Returns (resume_content, extracted_keywords, tailored_resume, review_data, diff_html); the last three are None on failure.
+    """
+    # --- Step 1: Read Resume and Extract Keywords (concurrently) ---
+    resume_content, extracted_keywords = await read_resume_and_extract_keywords(resume_data, file_type, job_description)
+
+    # --- Step 2: Tailor Resume ---
+    # Streaming renders on the script thread; nothing else is pending on the loop at this point
+    prompt = build_tailoring_prompt(resume_content, job_title, job_description, extracted_keywords, tailoring_style)
+    tailored_resume = stream_tailored_resume(prompt, stream_placeholder)
+    if not tailored_resume:
+        return resume_content, extracted_keywords, None, None, None
+
+    # --- Step 3: Get ATS Score and Review, building the diff while the review request is in flight ---
+    review_task = asyncio.create_task(get_resume_review_and_score(tailored_resume, job_title, job_description))
+    diff_html = await _run_in_thread(
+        generate_diff_html, clean_text_for_diff(resume_content), clean_text_for_diff(tailored_resume)
+    )
+    review_data = await review_task
+    return resume_content, extracted_keywords, tailored_resume, review_data, diff_html
+
+# --- Single-call tailoring pipeline (REZUME_FUSED_PIPELINE=1) ---
+_FUSED_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "keywords": {"type": "STRING", "description": "Comma-separated keywords extracted from the job description"},
+        "tailored_resume": {"type": "STRING", "description": "The full tailored resume text"},
+        "ats_score": {"type": "INTEGER", "description": "ATS compatibility score out of 100 for the tailored resume"},
+        "review": {"type": "STRING", "description": "Humanized review of the tailored resume"}
+    },
+    "required": ["keywords", "tailored_resume", "ats_score", "review"],
+    "propertyOrdering": ["keywords", "tailored_resume", "ats_score", "review"]
+}
+_FUSED_SCHEMA_JSON = orjson.dumps(_FUSED_SCHEMA, option=orjson.OPT_SORT_KEYS).decode()
+
+def build_fused_prompt(resume_content: str, job_title: str, job_description: str, tailoring_style: str) -> str:
+    """
+    Builds one prompt asking Gemini to extract keywords, tailor the resume with them, then score and review the result.
+    """
+    resume_content = fit_resume_for_prompt(resume_content)
+    job_description = compact_for_prompt(job_description)
+    return f"""
+    You are an expert resume writer, career coach and ATS (Applicant Tracking System) evaluator.
+    Work through these steps in order and respond ONLY with a valid JSON object.
+
+    1. Extract the most important 10-15 keywords, key skills, and essential requirements from the job description
+       as a comma-separated string ('keywords').
+    2. Tailor the original resume to the job title and job description, highlighting those keywords ('tailored_resume').
+       {tailoring_guidance_for(tailoring_style)}
+       Focus on relevant skills, experiences, and achievements. Keep the tone professional and impactful,
+       and include only the resume text itself.
+    3. Score the TAILORED resume for ATS compatibility out of 100 ('ats_score'). A higher score means better keyword matching and formatting for ATS.
+    4. Review the TAILORED resume from a human interviewer's perspective ('review'), covering strengths and weaknesses,
+       likely interview questions and concerns, readability and clarity, how well it highlights relevant experience,
+       and suggestions for further improvement. Be formal and detailed.
+
+    ---
+    **Original Resume:**
+    {resume_content}
+
+    ---
+    **Job Title:**
+    {job_title}
+
+    ---
+    **Job Description:**
+    {job_description}
+
+    ---
+    JSON Output:
+    """
+
+async def run_fused_tailoring_pipeline(resume_data: bytes, file_type: str, job_title: str, job_description: str, tailoring_style: str, stream_placeholder):
+    """
+    Same contract as run_tailoring_pipeline, but keywords, tailored resume and review come back from one Gemini call.
+    Trades the streamed preview for a single round-trip and sending the job description once (stream_placeholder stays empty).
+    """
+    resume_content = await _run_in_thread(read_resume_text, resume_data, file_type)
+
+    prompt = build_fused_prompt(resume_content, job_title, job_description, tailoring_style)
+    with st.spinner("Tailoring, scoring and reviewing your resume..."):
+        bundle = await call_gemini_api(prompt, temperature=0.4, max_output_tokens=FUSED_MAX_OUTPUT_TOKENS, schema_json_str=_FUSED_SCHEMA_JSON)
+    if not bundle or not bundle.get("tailored_resume"):
+        return resume_content, (bundle or {}).get("keywords", ""), None, None, None
+
+    review_data = {"ats_score": bundle.get("ats_score"), "review": bundle.get("review")}
+    diff_html = await _run_in_thread(
+        generate_diff_html, clean_text_for_diff(resume_content), clean_text_for_diff(bundle["tailored_resume"])
+    )
+    return resume_content, bundle.get("keywords", ""), bundle["tailored_resume"], review_data, diff_html
+
+# --- Function to extract text from a PDF resume ---
+# boxes_flow=None turns off pdfminer's hierarchical (quadratic) text-box grouping; lines and boxes are still
+# detected from character positions, so line breaks survive. (extract_text treats laparams=None as the defaults.)
+_PDFMINER_LAPARAMS = LAParams(boxes_flow=None)
+
+def _extract_text_pdfminer(data: bytes) -> str:
+    """
+    Extracts PDF text with pdfminer, limited to the pages we read and without advanced layout analysis.
+    """
+    return extract_text(io.BytesIO(data), maxpages=MAX_RESUME_PAGES, laparams=_PDFMINER_LAPARAMS)
+
+@st.cache_resource
+def _pdfium_lock() -> threading.Lock:
+    """
+    Returns the process-wide lock serializing PDFium calls, which are not thread-safe even across documents.
+    """
+    return threading.Lock()
+
+def _extract_text_pdfium(data: bytes) -> str:
+    """
+    Extracts the text of the first pages with PDFium, or returns "" if PDFium refuses to open the file.
+    Holds the PDFium lock from open to close, so concurrent uploads never call into PDFium at the same time.
+    """
+    with _pdfium_lock():
+        try:
+            pdf = pdfium.PdfDocument(data)
+        except pdfium.PdfiumError:
+            return ""
+        try:
+            page_texts = []
+            for index in range(min(len(pdf), MAX_RESUME_PAGES)):
+                page = pdf.get_page(index)
+                textpage = page.get_textpage()
+                page_texts.append(textpage.get_text_range())
+                # Close inside the lock rather than leaving it to the garbage collector on another thread
+                textpage.close()
+                page.close()
+        finally:
+            pdf.close()
+    # PDFium reports line breaks as CRLF; normalize them so diffs line up with TXT uploads
+    return "\n".join(page_texts).replace("\r\n", "\n")
+
+@st.cache_data(max_entries=128, show_spinner=False)
+def extract_pdf_text(data: bytes) -> str:
+    """
+    Extracts the text of a PDF using PDFium, which is much faster than pdfminer on born-digital resumes.
+    Falls back to pdfminer for files PDFium refuses to open or finds no text in.
+    Cached on the file bytes, so reruns with the same upload skip parsing entirely.
+    """
+    text = _extract_text_pdfium(data)
+    if not text.strip():
+        # Unreadable for PDFium, or no text layer (often a scanned resume); give pdfminer a second look
+        return _extract_text_pdfminer(data)
+    return text
+
+# --- Function to normalize text before diffing ---
+_LINE_BREAK_WHITESPACE = re.compile(r"\s*\n\s*") # A line break plus any surrounding blank lines/indentation
+
+def clean_text_for_diff(text: str) -> str:
+    """
+    Strips every line and drops blank lines in a single regex pass, so diffs ignore layout-only changes.
+    """
+    return _LINE_BREAK_WHITESPACE.sub("\n", text.strip())
+
+# --- Helpers to find the unchanged lines shared by both texts ---
+def _common_prefix_len(a: list, b: list) -> int:
+    """
+    Returns how many leading items the two lists have in common.
+    """
+    limit = min(len(a), len(b))
+    i = 0
+    while i < limit and a[i] == b[i]:
+        i += 1
+    return i
+
+def _common_suffix_len(a: list, b: list) -> int:
+    """
+    Returns how many trailing items the two lists have in common.
+    """
+    limit = min(len(a), len(b))
+    i = 0
+    while i < limit and a[-1 - i] == b[-1 - i]:
+        i += 1
+    return i
+
+# --- Diff operations, using the same codes as diff-match-patch ---
+_DIFF_DELETE, _DIFF_EQUAL, _DIFF_INSERT = -1, 0, 1
+
+# --- Word-level diff of a replaced block of lines ---
+_WORD_TOKENS = re.compile(r"\S+|\s+") # Words and the whitespace runs between them
+
+def _tokens_to_chars(tokens: list, token_array: list, token_index: dict) -> str:
+    """
+    Encodes each distinct token as one character (as diff-match-patch does for lines), so dmp diffs whole words.
+    """
+    chars = []
+    for token in tokens:
+        if token not in token_index:
+            token_index[token] = len(token_array)
+            token_array.append(token)
+        chars.append(chr(token_index[token]))
+    return "".join(chars)
+
+def _diff_replaced_block(old_block: str, new_block: str) -> list:
+    """
+    Diffs a replaced block of lines word by word with diff-match-patch.
+    Without the library installed, falls back to difflib on just this block.
+    Word tokens keep the sequences ~5x shorter than characters and hunks aligned to whole words.
+    """
+    old_tokens = _WORD_TOKENS.findall(old_block)
+    new_tokens = _WORD_TOKENS.findall(new_block)
+    if diff_match_patch is None:
+        # autojunk=False: within a small block, frequent tokens (spaces, "and") must still match
+        matcher = SequenceMatcher(None, old_tokens, new_tokens, autojunk=False)
+        diffs = []
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == 'equal':
+                diffs.append((_DIFF_EQUAL, "".join(old_tokens[i1:i2])))
+            if tag in ('delete', 'replace'):
+                diffs.append((_DIFF_DELETE, "".join(old_tokens[i1:i2])))
+            if tag in ('insert', 'replace'):
+                diffs.append((_DIFF_INSERT, "".join(new_tokens[j1:j2])))
+        return diffs
+    dmp = diff_match_patch()
+    dmp.Diff_Timeout = 1.0 # Cap diff time; on timeout dmp returns a coarser but still valid diff
+    token_array = [""] # Index 0 is unused, mirroring dmp's diff_linesToChars
+    token_index = {}
+    old_chars = _tokens_to_chars(old_tokens, token_array, token_index)
+    new_chars = _tokens_to_chars(new_tokens, token_array, token_index)
+    diffs = dmp.diff_main(old_chars, new_chars, False)
+    dmp.diff_charsToLines(diffs, token_array) # Decode the characters back into words
+    dmp.diff_cleanupSemantic(diffs) # Merge word-level noise into human-readable hunks
+    # Semantic cleanup can leave empty segments behind (diff_cleanupMerge doesn't remove all of them),
+    # which would render as empty <span>s
+    return [(op, text) for op, text in diffs if text]
+
+# --- Linear-time fallback diff for oversized inputs ---
+def _fast_line_diff(lines1: list, lines2: list) -> list:
+    """
+    Diffs two line lists in O(N) using only line membership (no LCS search), for inputs too large to diff properly.
+    Returns diff-match-patch style (op, text) tuples.
+    """
+    in_lines1 = set(lines1)
+    in_lines2 = set(lines2)
+    diffs = []
+    i = j = 0
+    while i < len(lines1) and j < len(lines2):
+        if lines1[i] == lines2[j]:
+            diffs.append((_DIFF_EQUAL, lines1[i]))
+            i += 1
+            j += 1
+        elif lines1[i] not in in_lines2:
+            diffs.append((_DIFF_DELETE, lines1[i]))
+            i += 1
+        elif lines2[j] not in in_lines1:
+            diffs.append((_DIFF_INSERT, lines2[j]))
+            j += 1
+        else: # Both lines exist elsewhere (moved); show it as a deletion and keep going
+            diffs.append((_DIFF_DELETE, lines1[i]))
+            i += 1
+    diffs.extend((_DIFF_DELETE, line) for line in lines1[i:])
+    diffs.extend((_DIFF_INSERT, line) for line in lines2[j:])
+    return diffs
+
 # --- Function to generate HTML diff ---
+_DIFF_MAX_CHARS = 200_000 # Above this, skip the LCS-based diff (e.g. garbled text from scanned PDFs)
+_DIFF_HTML_PREFIX = '<div class="diff-box">'
+_DIFF_HTML_SUFFIX = '</div>'
+# Unchanged text isn't wrapped and takes the wrapper's colour
+_DIFF_SPAN_OPEN = {_DIFF_INSERT: '<span class="diff-add">', _DIFF_DELETE: '<span class="diff-del">', _DIFF_EQUAL: ''}
+_DIFF_SPAN_CLOSE = {_DIFF_INSERT: '</span>', _DIFF_DELETE: '</span>', _DIFF_EQUAL: ''}
+
 def generate_diff_html(text1: str, text2: str) -> str:
     """
     Generates an HTML string highlighting differences between two texts.
     Additions are green, deletions are red.
     """
-    d = difflib.Differ()
-    diff = d.compare(text1.splitlines(keepends=True), text2.splitlines(keepends=True))
+    if text1 == text2:
+        return _DIFF_HTML_PREFIX + escape(text1, quote=False) + _DIFF_HTML_SUFFIX
 
-    html_diff = []
-    html_diff.append('<div style="font-family: monospace; white-space: pre-wrap; background-color: #2E3036; padding: 10px; border-radius: 8px; overflow-x: auto; border: 1px solid #555555;">')
-    for line in diff:
-        if line.startswith('+ '):
-            html_diff.append(f'<span style="background-color: #2F4F2F; color: #90EE90;">{line}</span>') # Darker Green for additions
-        elif line.startswith('- '):
-            html_diff.append(f'<span style="background-color: #4F2F2F; color: #FFB6C1;">{line}</span>') # Darker Red for deletions
-        else:
-            html_diff.append(f'<span style="color: #E0E0E0;">{line}</span>') # Light grey for no change
-    html_diff.append('</div>')
-    return "".join(html_diff)
+    lines1 = text1.splitlines(keepends=True)
+    lines2 = text2.splitlines(keepends=True)
+
+    # Only the changed middle needs diffing; the shared leading/trailing lines are emitted as-is
+    prefix_len = _common_prefix_len(lines1, lines2)
+    suffix_len = _common_suffix_len(lines1[prefix_len:], lines2[prefix_len:])
+    middle1 = lines1[prefix_len:len(lines1) - suffix_len]
+    middle2 = lines2[prefix_len:len(lines2) - suffix_len]
+
+    diffs = []
+    if prefix_len:
+        diffs.append((_DIFF_EQUAL, "".join(lines1[:prefix_len])))
+    if not middle1 or not middle2:
+        # Pure insertion or deletion (e.g. an empty side): nothing to align
+        if middle1:
+            diffs.append((_DIFF_DELETE, "".join(middle1)))
+        if middle2:
+            diffs.append((_DIFF_INSERT, "".join(middle2)))
+    elif max(len(text1), len(text2)) > _DIFF_MAX_CHARS:
+        diffs.extend(_fast_line_diff(middle1, middle2))
+    else:
+        # Align whole lines first, then refine only the replaced blocks word by word.
+        # The matcher compares precomputed line hashes (int compares); text is read back from the line lists.
+        matcher = SequenceMatcher(None, list(map(hash, middle1)), list(map(hash, middle2)), autojunk=True)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == 'equal':
+                diffs.append((_DIFF_EQUAL, "".join(middle1[i1:i2])))
+            elif tag == 'delete':
+                diffs.append((_DIFF_DELETE, "".join(middle1[i1:i2])))
+            elif tag == 'insert':
+                diffs.append((_DIFF_INSERT, "".join(middle2[j1:j2])))
+            else: # replace
+                diffs.extend(_diff_replaced_block("".join(middle1[i1:i2]), "".join(middle2[j1:j2])))
+    if suffix_len:
+        diffs.append((_DIFF_EQUAL, "".join(lines1[len(lines1) - suffix_len:])))
+
+    # Resume text is user content rendered with unsafe_allow_html, so every segment is escaped
+    html_diff = "".join(
+        _DIFF_SPAN_OPEN[op] + escape(data, quote=False) + _DIFF_SPAN_CLOSE[op] for op, data in diffs
+    )
+    return _DIFF_HTML_PREFIX + html_diff + _DIFF_HTML_SUFFIX
 
 # Set background color to black and text to white
-st.markdown("""
-<style>
+_THEME_CSS = """
     /* Ensure the main app container is black */
     .stApp {
         background-color: black !important;
@@ -261,6 +949,28 @@ st.markdown("""
         font-weight: bold;
     }
 
+    /* The diff view and its highlighted changes */
+    .diff-box {
+        font-family: monospace;
+        white-space: pre-wrap;
+        background-color: #2E3036;
+        color: #E0E0E0;
+        padding: 10px;
+        border-radius: 8px;
+        overflow-x: auto;
+        border: 1px solid #555555;
+    }
+
+    .diff-add {
+        background-color: #2F4F2F; /* Darker Green for additions */
+        color: #90EE90;
+    }
+
+    .diff-del {
+        background-color: #4F2F2F; /* Darker Red for deletions */
+        color: #FFB6C1;
+    }
+
     /* Info and Warning boxes */
     .stAlert {
         background-color: #333 !important;
@@ -277,8 +987,20 @@ st.markdown("""
         border-color: #f44336 !important; /* Red for error */
     }
 
-</style>
-""", unsafe_allow_html=True)
+"""
+
+@st.cache_resource(show_spinner=False)
+def _theme_html() -> str:
+    """
+    Returns the theme as a <style> tag, minified once per server process (comments and whitespace removed).
+    """
+    css = re.sub(r"/\*.*?\*/", "", _THEME_CSS, flags=re.DOTALL)
+    css = re.sub(r"\s*([{}:;,>])\s*", r"\1", css)
+    css = re.sub(r"\s+", " ", css).strip()
+    return f"<style>{css}</style>"
+
+# Streamlit drops any element a rerun doesn't emit, so the theme has to be sent on every run
+st.markdown(_theme_html(), unsafe_allow_html=True)
 
 
 # --- Initialize session state variables if they don't exist ---
@@ -290,6 +1012,12 @@ if 'original_resume_content' not in st.session_state:
     st.session_state.original_resume_content = None
 if 'extracted_keywords_display' not in st.session_state:
     st.session_state.extracted_keywords_display = None
+if 'diff_html' not in st.session_state:
+    st.session_state.diff_html = None
+if 'review_text' not in st.session_state:
+    st.session_state.review_text = None
+if 'review_json' not in st.session_state:
+    st.session_state.review_json = None
 
 
 st.title("✨ AI Resume Tailor")
@@ -314,72 +1042,40 @@ if st.button("Tailor My Resume 🚀"):
     st.session_state.review_data = None
     st.session_state.original_resume_content = None
     st.session_state.extracted_keywords_display = None
+    st.session_state.diff_html = None
+    st.session_state.review_text = None
+    st.session_state.review_json = None
+    stream_placeholder = st.empty() # Keeps the streamed resume on screen until the results are stored
 
     if uploaded_file is not None and job_title and job_description:
-        resume_content = ""
         try:
-            if uploaded_file.type == "text/plain":
-                resume_content = uploaded_file.read().decode("utf-8")
-            elif uploaded_file.type == "application/pdf":
-                resume_content = extract_text(io.BytesIO(uploaded_file.read()))
-            else:
+            if uploaded_file.type not in ("text/plain", "application/pdf"):
                 st.error("Unsupported file type. Please upload a TXT or PDF file.")
                 st.stop()
+            if uploaded_file.size > MAX_RESUME_BYTES:
+                st.error(f"Your resume file is too large ({uploaded_file.size / 1_000_000:.1f} MB). Please upload a file under {MAX_RESUME_BYTES / 1_000_000:.0f} MB.")
+                st.stop()
+
+            pipeline = run_fused_tailoring_pipeline if FUSED_PIPELINE else run_tailoring_pipeline
+            resume_content, extracted_keywords, tailored_resume, review_data, diff_html = asyncio.run(pipeline(
+                uploaded_file.getvalue(), uploaded_file.type, job_title, job_description, tailoring_style, stream_placeholder
+            ))
 
             # Store original content for diffing later
             st.session_state.original_resume_content = resume_content
-
-            # --- Step 1: Extract Keywords ---
-            extracted_keywords = asyncio.run(extract_keywords(job_description))
-            
             if not extracted_keywords:
                 st.session_state.extracted_keywords_display = "Could not extract keywords. Proceeding with general tailoring."
-                keywords_instruction = ""
             else:
                 st.session_state.extracted_keywords_display = f"Extracted Keywords: {extracted_keywords}"
-                keywords_instruction = f"Ensure the tailored resume highlights these specific keywords and phrases: {extracted_keywords}. "
-
-            # --- Step 2: Tailor Resume ---
-            tailoring_guidance = ""
-            if tailoring_style == "Concise":
-                tailoring_guidance = "Make the tailored resume concise and to the point, focusing only on the most relevant information."
-            elif tailoring_style == "Detailed":
-                tailoring_guidance = "Provide a detailed and comprehensive tailored resume, elaborating on experiences where relevant."
-            else: # Standard
-                tailoring_guidance = "Provide a balanced and standard tailored resume."
-
-            prompt = f"""
-            You are an expert resume writer and career coach. Your task is to tailor a given resume to a specific job description and job title.
-            {tailoring_guidance}
-            Focus on highlighting relevant skills, experiences, and achievements that directly match the requirements and keywords in the job description.
-            {keywords_instruction}
-            Ensure the tone is professional and impactful.
-            The output should ONLY be the tailored resume text. Do NOT include any conversational text, introductions, or conclusions.
-
-            ---
-            **Original Resume:**
-            {resume_content}
-
-            ---
-            **Job Title:**
-            {job_title}
-
-            ---
-            **Job Description:**
-            {job_description}
-
-            ---
-            **Tailored Resume:**
-            """
-
-            with st.spinner("Tailoring your resume... This might take a moment. ✨"):
-                st.session_state.tailored_resume = asyncio.run(call_gemini_api(prompt))
-
-            if st.session_state.tailored_resume:
-                # --- Step 3: Get ATS Score and Review ---
-                st.session_state.review_data = asyncio.run(get_resume_review_and_score(
-                    st.session_state.tailored_resume, job_title, job_description
-                ))
+
+            if tailored_resume:
+                st.session_state.tailored_resume = tailored_resume
+                st.session_state.review_data = review_data
+                st.session_state.diff_html = diff_html
+                if review_data and 'ats_score' in review_data and 'review' in review_data:
+                    # Download payloads are built once here, not on every rerun of the results section
+                    st.session_state.review_text = format_review_text(review_data)
+                    st.session_state.review_json = orjson.dumps(review_data, option=orjson.OPT_INDENT_2)
             else:
                 st.error("Failed to tailor resume. Please try again.")
                 st.session_state.tailored_resume = None # Reset on failure
@@ -392,11 +1088,21 @@ if st.button("Tailor My Resume 🚀"):
             st.session_state.review_data = None # Reset on error
             st.session_state.original_resume_content = None
             st.session_state.extracted_keywords_display = None
+            st.session_state.diff_html = None
+            st.session_state.review_text = None
+            st.session_state.review_json = None
     else:
         st.warning("Please upload your resume, enter a job title, and paste the job description to proceed.")
+    # The results section below renders the final text, so the streamed copy goes away right before it
+    stream_placeholder.empty()
 
 # --- Display Results if available in session_state ---
-if st.session_state.tailored_resume:
+@st.experimental_fragment
+def render_results():
+    """
+    Renders the tailored resume, diff, review and download buttons.
+    Runs as a fragment, so interacting with these widgets reruns only this section, not the whole script.
+    """
     if st.session_state.extracted_keywords_display:
         st.info(st.session_state.extracted_keywords_display)
 
@@ -404,11 +1110,8 @@ if st.session_state.tailored_resume:
     st.markdown(st.session_state.tailored_resume)
 
     st.subheader("Changes Highlighted 🔍")
-    # Clean up original and tailored text for diffing (remove empty lines)
-    cleaned_original = "\n".join([line.strip() for line in st.session_state.original_resume_content.splitlines() if line.strip()])
-    cleaned_tailored = "\n".join([line.strip() for line in st.session_state.tailored_resume.splitlines() if line.strip()])
-    diff_html = generate_diff_html(cleaned_original, cleaned_tailored)
-    st.markdown(diff_html, unsafe_allow_html=True)
+    # The diff is built once by the tailoring pipeline and reused on every rerun
+    st.markdown(st.session_state.diff_html, unsafe_allow_html=True)
 
     st.download_button(
         label="Download Tailored Resume",
@@ -417,38 +1120,36 @@ if st.session_state.tailored_resume:
         mime="text/plain"
     )
 
-if st.session_state.review_data and 'ats_score' in st.session_state.review_data and 'review' in st.session_state.review_data:
-    st.subheader("Resume Review & ATS Score 📊")
-    st.markdown(
-        f"""
-        <div class="score-box">
-            <p><strong>ATS Compatibility Score:</strong> <span class="score-text">{st.session_state.review_data['ats_score']}/100</span></p>
-            <p><strong>Humanized Review:</strong></p>
-            <p>{st.session_state.review_data['review']}</p>
-        </div>
-        """,
-        unsafe_allow_html=True
-    )
+    if st.session_state.review_text:
+        st.subheader("Resume Review & ATS Score 📊")
+        st.markdown(
+            f"""
+            <div class="score-box">
+                <p><strong>ATS Compatibility Score:</strong> <span class="score-text">{st.session_state.review_data['ats_score']}/100</span></p>
+                <p><strong>Humanized Review:</strong></p>
+                <p>{st.session_state.review_data['review']}</p>
+            </div>
+            """,
+            unsafe_allow_html=True
+        )
 
-    # --- Download Resume Review and Score ---
-    review_output_text = f"--- Resume Review and ATS Score ---\n\n" \
-                         f"ATS Compatibility Score: {st.session_state.review_data['ats_score']}/100\n\n" \
-                         f"Humanized Review:\n{st.session_state.review_data['review']}\n\n" \
-                         f"--- End of Review ---"
+        # --- Download Resume Review and Score ---
+        st.download_button(
+            label="Download Review & Score (TXT)",
+            data=st.session_state.review_text,
+            file_name="resume_review_and_score.txt",
+            mime="text/plain"
+        )
 
-    st.download_button(
-        label="Download Review & Score (TXT)",
-        data=review_output_text,
-        file_name="resume_review_and_score.txt",
-        mime="text/plain"
-    )
+        # Option to download as JSON:
+        st.download_button(
+            label="Download Review & Score (JSON)",
+            data=st.session_state.review_json,
+            file_name="resume_review_and_score.json",
+            mime="application/json"
+        )
 
-    # Option to download as JSON:
-    st.download_button(
-        label="Download Review & Score (JSON)",
-        data=json.dumps(st.session_state.review_data, indent=4),
-        file_name="resume_review_and_score.json",
-        mime="application/json"
-    )
+if st.session_state.tailored_resume:
+    render_results()
 
 st.markdown("---")
\ No newline at end of file